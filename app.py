@@ -1,148 +1,86 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context
 from reports import ReportGenerator
+import functools
 import json
 import os
 import sys
+import time
 from flask import send_file
 from datetime import datetime
 import secrets
+import uuid
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from flask_compress import Compress
+except ImportError:
+    Compress = None
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
-sys.path.append(current_dir)
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
 
-from scripts.ollama_client import OllamaClient, test_connection
+from scripts.ollama_client import DEFAULT_MODEL, test_connection
+from scripts.road_safety_gpt import get_road_safety_gpt, DB_PATH
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)
+# Set SECRET_KEY when running several workers so they all accept the same session cookie
+app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(16)
+if Compress is not None:
+    # gzip/brotli the JSON API responses
+    Compress(app)
 
-class RoadSafetyGPT:
-    def __init__(self):
-        self.client = OllamaClient()
-        self.database = self.load_database()
-        self.system_prompt = self.load_system_prompt()
-    
-    def load_database(self):
-        """Load the processed interventions database"""
-        try:
-            db_path = os.path.join(current_dir, 'data', 'processed_database.json')
-            print(f"Looking for database at: {db_path}")
-            print(f"File exists: {os.path.exists(db_path)}")
-            
-            with open(db_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            print("Error: Processed database not found.")
-            print(f"Expected at: {db_path}")
-            print("Please check if the file exists at this location.")
-            return []
-    
-    def load_system_prompt(self):
-        """Load the system prompt"""
-        try:
-            prompt_path = os.path.join(current_dir, 'prompts', 'system_prompt.txt')
-            print(f"Looking for system prompt at: {prompt_path}")
-            
-            with open(prompt_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        except FileNotFoundError:
-            print("Warning: System prompt not found, using default")
-            return "You are a Road Safety Expert AI assistant."
-    
-    def prepare_database_context(self, user_query=""):
-        """Prepare focused database context for the AI"""
-        keyword_matches = self.search_interventions(user_query)
-        relevant_interventions = keyword_matches[:5] if keyword_matches else self.database[:8]
-        
-        context = "RELEVANT ROAD SAFETY INTERVENTIONS:\n\n"
-        
-        for intervention in relevant_interventions:
-            context += f"{intervention['intervention_name']}\n"
-            context += f"   Problem Type: {intervention['problem_type']}\n"
-            context += f"   Category: {intervention['category']}\n"
-            context += f"   Standard: {intervention['standard_code']} Clause {intervention['clause']}\n"
-            context += f"   Description: {intervention['description']}\n"
-            context += "─" * 50 + "\n"
-        
-        return context
-    
-    def search_interventions(self, user_query):
-        """Improved keyword-based search"""
-        query_lower = user_query.lower()
-        matches = []
-        
-        for intervention in self.database:
-            score = 0
-            
-            if intervention['problem_type'].lower() in query_lower:
-                score += 10
-            
-            if intervention['intervention_name'].lower() in query_lower:
-                score += 8
-            
-            if intervention['category'].lower() in query_lower:
-                score += 5
-            
-            for keyword in intervention['keywords']:
-                if keyword.lower() in query_lower:
-                    score += 2
-            
-            for road_type in intervention['road_types']:
-                if road_type.lower() in query_lower:
-                    score += 3
-            for env in intervention['environments']:
-                if env.lower() in query_lower:
-                    score += 3
-            
-            if score > 0:
-                matches.append((score, intervention))
-        
-        matches.sort(key=lambda x: x[0], reverse=True)
-        return [match[1] for match in matches]
-    
-    def get_response(self, user_query):
-        """Get AI response for user query"""
-        keyword_matches = self.search_interventions(user_query)
-        focused_context = self.prepare_database_context(user_query)
-        response = self.client.query_road_safety(
-            user_query, 
-            focused_context, 
-            self.system_prompt
-        )
-        
-        return {
-            'ai_response': response,
-            'keyword_matches': keyword_matches[:3]  
-        }
+def ojsonify(payload):
+    """jsonify, but serialized with orjson when it's available"""
+    if orjson is None:
+        return jsonify(payload)
+    return app.response_class(orjson.dumps(payload), mimetype='application/json')
+
+def conditional_ojsonify(payload):
+    """ojsonify with a content ETag, answering 304 when the client's copy still matches"""
+    response = ojsonify(payload)
+    # Weak: compression may change the bytes on the wire, not the JSON they carry
+    response.add_etag(weak=True)
+    return response.make_conditional(request)
 
+def sse_event(payload):
+    """One Server-Sent Events frame carrying payload as JSON"""
+    data = orjson.dumps(payload).decode() if orjson else json.dumps(payload)
+    return f"data: {data}\n\n"
 
+def public_fields(intervention):
+    """Copy of an intervention without the precomputed search fields"""
+    return {k: v for k, v in intervention.items() if not k.startswith('_')}
+
+import queue
 import sqlite3
-from datetime import datetime, date
+import threading
+from datetime import datetime, date, timezone
 
 class Analytics:
-    def __init__(self, road_safety_gpt):
-        self.road_safety_gpt = road_safety_gpt
-        self.db_path = os.path.join(current_dir, 'data', 'analytics.db')
-        self.init_database()
-    
-    def init_database(self):
-        """Initialize SQLite database for analytics"""
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_queries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+    # The background writer flushes after this many queued queries or seconds
+    BATCH_SIZE = 100
+    FLUSH_INTERVAL = 0.5
+    # Queued logs beyond this are dropped rather than held while the disk is stuck
+    QUEUE_SIZE = 10000
+    # Seconds a computed dashboard is served before the aggregates are re-run
+    DASHBOARD_TTL = 30
+    # Plain INTEGER PRIMARY KEY aliases the rowid; AUTOINCREMENT would add a
+    # sqlite_sequence update to every insert for a guarantee nothing here needs
+    TABLES = {
+        'user_queries': '''
+                id INTEGER PRIMARY KEY,
                 user_query TEXT,
                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
                 matched_interventions_count INTEGER,
                 response_time FLOAT
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS query_interventions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ''',
+        'query_interventions': '''
+                id INTEGER PRIMARY KEY,
                 query_id INTEGER,
                 intervention_id TEXT,
                 intervention_name TEXT,
@@ -150,90 +88,207 @@ class Analytics:
                 category TEXT,
                 match_score INTEGER,
                 FOREIGN KEY (query_id) REFERENCES user_queries (id)
-            )
-        ''')
-        conn.commit()
-        conn.close()
+            ''',
+    }
     
-    def log_query(self, user_query, matched_interventions, response_time):
-        """Log each user query and matched interventions from your main database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def __init__(self, road_safety_gpt, db_path=None):
+        self.road_safety_gpt = road_safety_gpt
+        self.db_path = db_path or os.path.join(current_dir, 'data', 'analytics.db')
+        # One shared write connection; the lock serializes access to it
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._conn = None
+        # (data version, computed at, stats); the writer bumps the version on flush
+        self._dash_cache = None
+        self._dash_version = 0
+        self.init_database()
+        self._q = queue.Queue(maxsize=self.QUEUE_SIZE)
+        threading.Thread(target=self._writer, daemon=True).start()
+    
+    def init_database(self):
+        """Initialize SQLite database for analytics"""
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        cursor = self._conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
         
-        cursor.execute('''
-            INSERT INTO user_queries (user_query, matched_interventions_count, response_time)
-            VALUES (?, ?, ?)
-        ''', (user_query, len(matched_interventions), response_time))
+        for table, columns in self.TABLES.items():
+            cursor.execute(f'CREATE TABLE IF NOT EXISTS {table} ({columns})')
+            self._drop_autoincrement(cursor, table, columns)
         
-        query_id = cursor.lastrowid
+        # Back the dashboard's GROUP BYs and the 7-day timestamp range filter
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_qi_pt ON query_interventions(problem_type)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_qi_cat ON query_interventions(category)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_qi_name ON query_interventions(intervention_name)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_uq_ts ON user_queries(timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_uq_query ON user_queries(user_query)')
+        # Refresh planner statistics so the GROUP BYs pick the indexes above
+        cursor.execute('PRAGMA optimize')
     
-        for intervention in matched_interventions:
-            cursor.execute('''
-                INSERT INTO query_interventions (query_id, intervention_id, intervention_name, problem_type, category)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (query_id, 
-                  intervention.get('intervention_id', ''),
-                  intervention.get('intervention_name', ''),
-                  intervention.get('problem_type', ''),
-                  intervention.get('category', '')))
-        
-        conn.commit()
-        conn.close()
+    def _drop_autoincrement(self, cursor, table, columns):
+        """Rebuild a table created with AUTOINCREMENT as a plain rowid table, keeping its ids"""
+        row = cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+        if 'AUTOINCREMENT' not in row['sql'].upper():
+            return
+        cursor.execute('BEGIN')
+        try:
+            cursor.execute(f'CREATE TABLE {table}_new ({columns})')
+            cursor.execute(f'INSERT INTO {table}_new SELECT * FROM {table}')
+            cursor.execute(f'DROP TABLE {table}')
+            cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+            cursor.execute('DELETE FROM sqlite_sequence WHERE name=?', (table,))
+            cursor.execute('COMMIT')
+        except sqlite3.Error:
+            cursor.execute('ROLLBACK')
+            raise
+        print(f"Migrated analytics table {table} off AUTOINCREMENT")
+    
+    def log_query(self, user_query, matched_interventions, response_time):
+        """Queue a user query and its matched interventions for the background writer"""
+        # CURRENT_TIMESTAMP format, taken now rather than when the batch is flushed
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        rows = [(intervention.get('intervention_id', ''),
+                 intervention.get('intervention_name', ''),
+                 intervention.get('problem_type', ''),
+                 intervention.get('category', ''))
+                for intervention in matched_interventions]
+        try:
+            # Never block a chat request on analytics
+            self._q.put_nowait((user_query, timestamp, response_time, rows))
+        except queue.Full:
+            print("Analytics queue full, dropping query log")
+    
+    def _writer(self):
+        """Drain queued query logs into SQLite in batches"""
+        while True:
+            batch = [self._q.get()]
+            deadline = time.monotonic() + self.FLUSH_INTERVAL
+            while len(batch) < self.BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._q.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                # Never let one bad log kill the writer: retry row by row and
+                # drop only the rows that still fail
+                print(f"Error writing analytics batch: {e}")
+                for entry in batch if len(batch) > 1 else ():
+                    try:
+                        self._write_batch([entry])
+                    except Exception as e:
+                        print(f"Dropping analytics query log: {e}")
+            # New rows make the cached dashboard stale
+            self._dash_version += 1
+    
+    def _write_batch(self, batch):
+        """Insert a batch of queued query logs in a single transaction"""
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN")
+            try:
+                intervention_rows = []
+                for user_query, timestamp, response_time, rows in batch:
+                    cursor.execute('''
+                        INSERT INTO user_queries (user_query, timestamp, matched_interventions_count, response_time)
+                        VALUES (?, ?, ?, ?)
+                    ''', (user_query, timestamp, len(rows), response_time))
+                    query_id = cursor.lastrowid
+                    intervention_rows.extend((query_id, *row) for row in rows)
+                
+                cursor.executemany('''
+                    INSERT INTO query_interventions (query_id, intervention_id, intervention_name, problem_type, category)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', intervention_rows)
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+    
+    def _reader(self):
+        """This thread's own read connection; under WAL reads never wait on the writer"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
     
     def get_dashboard_stats(self):
         """Get analytics based on your actual interventions database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('SELECT COUNT(*) FROM user_queries')
-        total_reports = cursor.fetchone()[0]
-    
-        cursor.execute('''
-            SELECT problem_type, COUNT(*) as count 
-            FROM query_interventions 
-            GROUP BY problem_type 
-            ORDER BY count DESC 
-            LIMIT 5
-        ''')
-        top_problems = [{'problem_type': row[0], 'count': row[1]} for row in cursor.fetchall()]
-        
-        cursor.execute('''
-            SELECT category, COUNT(*) as count 
-            FROM query_interventions 
-            GROUP BY category 
-            ORDER BY count DESC 
-            LIMIT 5
-        ''')
-        top_categories = [{'category': row[0], 'count': row[1]} for row in cursor.fetchall()]
+        cached = self._dash_cache
+        if cached and cached[0] == self._dash_version and time.time() - cached[1] < self.DASHBOARD_TTL:
+            return cached[2]
         
-        cursor.execute('''
-            SELECT intervention_name, COUNT(*) as count 
-            FROM query_interventions 
-            GROUP BY intervention_name 
-            ORDER BY count DESC 
-            LIMIT 10
-        ''')
-        top_interventions = [{'intervention': row[0], 'count': row[1]} for row in cursor.fetchall()]
-        
-        cursor.execute('''
-            SELECT DATE(timestamp) as date, COUNT(*) as count 
-            FROM user_queries 
-            WHERE timestamp >= date('now', '-7 days')
-            GROUP BY DATE(timestamp) 
-            ORDER BY date
-        ''')
-        daily_reports = [{'date': row[0], 'count': row[1]} for row in cursor.fetchall()]
-        
-        cursor.execute('''
-            SELECT user_query, COUNT(*) as count 
-            FROM user_queries 
-            GROUP BY user_query 
-            ORDER BY count DESC 
-            LIMIT 10
-        ''')
-        common_issues = [{'issue': row[0], 'count': row[1]} for row in cursor.fetchall()]
-        
-        conn.close()
+        # Read the version first so a flush during the queries isn't cached as current
+        version = self._dash_version
+        stats = self._compute_dashboard_stats()
+        self._dash_cache = (version, time.time(), stats)
+        return stats
+    
+    def _compute_dashboard_stats(self):
+        """Run the dashboard aggregation queries"""
+        cursor = self._reader().cursor()
+        # One read transaction, so every figure comes from the same snapshot
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute('SELECT COUNT(*) FROM user_queries')
+            total_reports = cursor.fetchone()[0]
+
+            cursor.execute('''
+                SELECT problem_type, COUNT(*) as count 
+                FROM query_interventions 
+                GROUP BY problem_type 
+                ORDER BY count DESC 
+                LIMIT 5
+            ''')
+            top_problems = [dict(row) for row in cursor.fetchall()]
+
+            cursor.execute('''
+                SELECT category, COUNT(*) as count 
+                FROM query_interventions 
+                GROUP BY category 
+                ORDER BY count DESC 
+                LIMIT 5
+            ''')
+            top_categories = [dict(row) for row in cursor.fetchall()]
+
+            cursor.execute('''
+                SELECT intervention_name as intervention, COUNT(*) as count 
+                FROM query_interventions 
+                GROUP BY intervention_name 
+                ORDER BY count DESC 
+                LIMIT 10
+            ''')
+            top_interventions = [dict(row) for row in cursor.fetchall()]
+
+            cursor.execute('''
+                SELECT DATE(timestamp) as date, COUNT(*) as count 
+                FROM user_queries 
+                WHERE timestamp >= date('now', '-7 days')
+                GROUP BY DATE(timestamp) 
+                ORDER BY date
+            ''')
+            daily_reports = [dict(row) for row in cursor.fetchall()]
+
+            cursor.execute('''
+                SELECT user_query as issue, COUNT(*) as count 
+                FROM user_queries 
+                GROUP BY user_query 
+                ORDER BY count DESC 
+                LIMIT 10
+            ''')
+            common_issues = [dict(row) for row in cursor.fetchall()]
+        finally:
+            cursor.execute("COMMIT")
         
         return {
             'total_reports': total_reports,
@@ -244,75 +299,228 @@ class Analytics:
             'common_issues': common_issues,
             'total_interventions_in_db': len(self.road_safety_gpt.database) 
         }
-road_safety_gpt = RoadSafetyGPT()
-analytics = Analytics(road_safety_gpt)
+    
+    def get_interventions_usage(self):
+        """Get how often each intervention has been recommended"""
+        cursor = self._reader().cursor()
+        cursor.execute('''
+            SELECT 
+                intervention_name,
+                problem_type,
+                category,
+                COUNT(*) as usage_count
+            FROM query_interventions
+            GROUP BY intervention_name, problem_type, category
+            ORDER BY usage_count DESC
+            LIMIT 15
+        ''')
+        rows = cursor.fetchall()
+        
+        # Descriptions aren't logged, so take them from the loaded interventions
+        descriptions = {iv['intervention_name']: iv['description'] for iv in self.road_safety_gpt.database}
+        
+        interventions_usage = [dict(row) for row in rows]
+        for usage in interventions_usage:
+            usage['description'] = descriptions.get(usage['intervention_name']) or "No description available"
+        return interventions_usage
+
+class ChatHistory:
+    """Server-side chat transcripts, keyed by the session id held in the cookie"""
+    # Turns returned by get(); older ones stay stored but aren't sent
+    HISTORY_LIMIT = 50
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS chat_history (
+                id INTEGER PRIMARY KEY,
+                session_id TEXT,
+                timestamp TEXT,
+                user_message TEXT,
+                assistant_message TEXT
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_ch_session ON chat_history(session_id)')
+    
+    def append(self, session_id, user_message, assistant_message, timestamp):
+        """Store one chat turn"""
+        with self._lock:
+            self._conn.execute('''
+                INSERT INTO chat_history (session_id, timestamp, user_message, assistant_message)
+                VALUES (?, ?, ?, ?)
+            ''', (session_id, timestamp, user_message, assistant_message))
+    
+    def get(self, session_id):
+        """Get a session's most recent HISTORY_LIMIT turns, oldest first"""
+        with self._lock:
+            rows = self._conn.execute('''
+                SELECT user_message, assistant_message, timestamp
+                FROM chat_history
+                WHERE session_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (session_id, self.HISTORY_LIMIT)).fetchall()
+        return [{'user': row[0], 'assistant': row[1], 'timestamp': row[2]} for row in reversed(rows)]
+    
+    def clear(self, session_id):
+        """Delete a session's turns"""
+        with self._lock:
+            self._conn.execute('DELETE FROM chat_history WHERE session_id = ?', (session_id,))
+
+# Built on first use rather than at import, once per process (or gunicorn worker)
+@functools.lru_cache(maxsize=1)
+def get_analytics():
+    return Analytics(get_road_safety_gpt())
+
+@functools.lru_cache(maxsize=1)
+def get_chat_history():
+    return ChatHistory(get_analytics().db_path)
+
+@functools.lru_cache(maxsize=1)
+def get_report_generator():
+    return ReportGenerator('data')
+
+def create_app():
+    """Load the database and open the analytics stores, then return the Flask app"""
+    get_chat_history()
+    # Have Ollama load the model now rather than on the first chat request
+    get_road_safety_gpt().client.warm_up()
+    return app
+
+def get_session_id():
+    """Id that keys this browser's server-side chat history"""
+    if 'session_id' not in session:
+        session['session_id'] = uuid.uuid4().hex
+    return session['session_id']
 @app.route('/')
 def index():
     """Render the main chat interface"""
-    if 'chat_history' not in session:
-        session['chat_history'] = []
+    get_session_id()
     return render_template('index.html')
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Handle chat requests"""
     try:
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         data = request.get_json()
         user_message = data.get('message', '').strip()
         
         if not user_message:
-            return jsonify({'error': 'Empty message'}), 400
+            return ojsonify({'error': 'Empty message'}), 400
     
-        result = road_safety_gpt.get_response(user_message)
-        response_text = result['ai_response']
-        
-        if result['keyword_matches']:
-            response_text += "\n\n**Quick Reference Matches:**\n"
-            for i, match in enumerate(result['keyword_matches'], 1):
-                response_text += f"\n{i}. **{match['intervention_name']}** ({match['category']})\n"
-                response_text += f"   - Problem: {match['problem_type']}\n"
-                response_text += f"   - Standard: {match['standard_code']} {match['clause']}\n"
-        
-       
-        response_time = (datetime.now() - start_time).total_seconds()
-        analytics.log_query(user_message, result['keyword_matches'], response_time)
+        result = get_road_safety_gpt().get_response(user_message)
+        response_text = result['ai_response'] + format_quick_reference(result['keyword_matches'])
         
-        if 'chat_history' not in session:
-            session['chat_history'] = []
+        response_time = time.perf_counter() - start_time
+        get_analytics().log_query(user_message, result['keyword_matches'], response_time)
         
-        session['chat_history'].append({
-            'user': user_message,
-            'assistant': response_text,
-            'timestamp': datetime.now().isoformat()
-        })
-        session.modified = True
+        get_chat_history().append(get_session_id(), user_message, response_text, datetime.now().isoformat())
         
-        return jsonify({
+        return ojsonify({
             'response': response_text,
             'timestamp': datetime.now().isoformat()
         })
     
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return ojsonify({'error': str(e)}), 500
+
+# Tokens per SSE frame: the first goes out alone, later frames carry more
+STREAM_BATCH_SIZES = (1, 3, 9, 27, 50)
+# Seconds after which a partial batch is flushed anyway
+STREAM_FLUSH_INTERVAL = 0.05
+
+def batch_chunks(chunks):
+    """Join streamed tokens into frames of growing size"""
+    buffer = []
+    step = 0
+    last_flush = time.monotonic()
+    for chunk in chunks:
+        buffer.append(chunk)
+        if (len(buffer) >= STREAM_BATCH_SIZES[step]
+                or time.monotonic() - last_flush >= STREAM_FLUSH_INTERVAL):
+            yield "".join(buffer)
+            buffer = []
+            step = min(step + 1, len(STREAM_BATCH_SIZES) - 1)
+            last_flush = time.monotonic()
+    if buffer:
+        yield "".join(buffer)
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Handle chat requests, streaming the reply as Server-Sent Events"""
+    try:
+        start_time = time.perf_counter()
+        data = request.get_json()
+        user_message = data.get('message', '').strip()
+        
+        if not user_message:
+            return ojsonify({'error': 'Empty message'}), 400
+        
+        # The session cookie can't change once streaming starts, so resolve the id now
+        session_id = get_session_id()
+        result = get_road_safety_gpt().stream_response(user_message)
+    
+    except Exception as e:
+        return ojsonify({'error': str(e)}), 500
+    
+    def generate():
+        parts = []
+        try:
+            for chunk in batch_chunks(result['ai_response']):
+                parts.append(chunk)
+                yield sse_event({'delta': chunk})
+            
+            quick_reference = format_quick_reference(result['keyword_matches'])
+            if quick_reference:
+                parts.append(quick_reference)
+                yield sse_event({'delta': quick_reference})
+        except Exception as e:
+            # Headers are already sent, so the failure goes out as a final frame
+            yield sse_event({'error': str(e)})
+            return
+        finally:
+            # Record the turn even if the client disconnects mid-stream
+            response_time = time.perf_counter() - start_time
+            get_analytics().log_query(user_message, result['keyword_matches'], response_time)
+            get_chat_history().append(session_id, user_message, "".join(parts), datetime.now().isoformat())
+        
+        yield sse_event({'done': True, 'timestamp': datetime.now().isoformat()})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
+def format_quick_reference(keyword_matches):
+    """Markdown list of the top keyword matches appended to each reply"""
+    if not keyword_matches:
+        return ""
+    parts = ["\n\n**Quick Reference Matches:**\n"]
+    for i, match in enumerate(keyword_matches, 1):
+        parts.append(
+            f"\n{i}. **{match['intervention_name']}** ({match['category']})\n"
+            f"   - Problem: {match['problem_type']}\n"
+            f"   - Standard: {match['standard_code']} {match['clause']}\n"
+        )
+    return "".join(parts)
+
 @app.route('/api/clear', methods=['POST'])
 def clear_chat():
     """Clear chat history"""
-    session['chat_history'] = []
-    session.modified = True
-    return jsonify({'status': 'success'})
+    get_chat_history().clear(get_session_id())
+    return ojsonify({'status': 'success'})
 
 @app.route('/api/history', methods=['GET'])
 def get_history():
     """Get chat history"""
-    history = session.get('chat_history', [])
-    return jsonify({'history': history})
+    history = get_chat_history().get(get_session_id())
+    return ojsonify({'history': history})
 # Report Generation Routes
 @app.route('/api/generate-pdf-report')
 def generate_pdf_report():
     """Generate and download PDF report"""
     try:
-        generator = ReportGenerator('data')
+        generator = get_report_generator()
         pdf_path = generator.generate_pdf_report()
         
         # Return the file for download
@@ -323,13 +531,13 @@ def generate_pdf_report():
             mimetype='application/pdf'
         )
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+        return ojsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/generate-excel-report')
 def generate_excel_report():
     """Generate and download Excel report"""
     try:
-        generator = ReportGenerator('data')
+        generator = get_report_generator()
         excel_path = generator.generate_excel_report()
         
         # Return the file for download
@@ -340,7 +548,7 @@ def generate_excel_report():
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
         )
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+        return ojsonify({'success': False, 'error': str(e)})
 
 
 @app.route('/api/generate-compliance-checklist', methods=['POST'])
@@ -350,15 +558,15 @@ def generate_compliance_checklist():
         data = request.get_json()
         interventions = data.get('interventions', [])
         
-        generator = ReportGenerator('data')
+        generator = get_report_generator()
         checklist = generator.generate_compliance_checklist(interventions)
         
-        return jsonify({
+        return ojsonify({
             'success': True,
             'checklist': checklist
         })
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+        return ojsonify({'success': False, 'error': str(e)})
 
 @app.route('/reports')
 def reports_page():
@@ -369,62 +577,37 @@ def reports_page():
 def get_priority_ranking():
     """Get interventions with priority ranking"""
     try:
-        # Load interventions from database
-        with open('data/processed_database.json', 'r') as f:
-            interventions = json.load(f)
+        # Priority and cost estimation are precomputed by load_database
+        interventions = []
+        for iv in get_road_safety_gpt().database[:10]:  # Limit to top 10 for demo
+            intervention = public_fields(iv)
+            intervention['priority'] = iv['_priority']
+            intervention['estimated_cost'] = iv['_cost']
+            intervention['timeline'] = iv['_timeline']
+            interventions.append(intervention)
         
-        # Add priority and cost estimation
-        for intervention in interventions[:10]:  # Limit to top 10 for demo
-            intervention['priority'] = calculate_priority(intervention)
-            intervention['estimated_cost'] = estimate_cost(intervention)
-            intervention['timeline'] = estimate_timeline(intervention)
-        
-        return jsonify({
+        return ojsonify({
             'success': True,
-            'interventions': interventions[:10]
+            'interventions': interventions
         })
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
-
-def calculate_priority(intervention):
-    """Calculate priority based on intervention type"""
-    priority_map = {
-        'Traffic Signs': 'High',
-        'Road Markings': 'Medium',
-        'Pedestrian Facilities': 'High',
-        'Speed Management': 'High',
-        'Lighting': 'Medium',
-        'Drainage': 'Low'
-    }
-    return priority_map.get(intervention.get('category', ''), 'Medium')
-
-def estimate_cost(intervention):
-    """Estimate cost based on intervention type"""
-    cost_ranges = {
-        'High': '₹2,00,000 - ₹10,00,000',
-        'Medium': '₹50,000 - ₹2,00,000',
-        'Low': '₹5,000 - ₹50,000'
-    }
-    priority = calculate_priority(intervention)
-    return cost_ranges.get(priority, '₹50,000 - ₹2,00,000')
-
-def estimate_timeline(intervention):
-    """Estimate timeline based on priority"""
-    timeline_map = {
-        'High': '1-2 weeks',
-        'Medium': '2-4 weeks',
-        'Low': '4-8 weeks'
-    }
-    priority = calculate_priority(intervention)
-    return timeline_map.get(priority, '2-4 weeks')
+        return ojsonify({'success': False, 'error': str(e)})
+
+# Seconds to reuse the last Ollama connectivity check for status polls
+STATUS_TTL = 5
+_status_cache = {'ok': False, 'ts': 0}
+
 @app.route('/api/status', methods=['GET'])
 def status():
     """Check system status"""
-    ollama_status = test_connection()
-    return jsonify({
-        'ollama_connected': ollama_status,
-        'database_loaded': len(road_safety_gpt.database) > 0,
-        'intervention_count': len(road_safety_gpt.database)
+    now = time.monotonic()
+    if not _status_cache['ts'] or now - _status_cache['ts'] > STATUS_TTL:
+        # Live probe: the status light should go red as soon as Ollama stops
+        _status_cache.update(ok=test_connection(use_cache=False), ts=now)
+    return conditional_ojsonify({
+        'ollama_connected': _status_cache['ok'],
+        'database_loaded': len(get_road_safety_gpt().database) > 0,
+        'intervention_count': len(get_road_safety_gpt().database)
     })
 
 @app.route('/api/debug', methods=['POST'])
@@ -433,10 +616,10 @@ def debug_query():
     data = request.get_json()
     user_message = data.get('message', '').strip()
     
-    database_context = road_safety_gpt.prepare_database_context(user_message)
-    keyword_matches = road_safety_gpt.search_interventions(user_message)
+    keyword_matches = get_road_safety_gpt().search_interventions(user_message)
+    database_context = get_road_safety_gpt().prepare_database_context(user_message, keyword_matches)
     
-    return jsonify({
+    return ojsonify({
         'user_query': user_message,
         'database_context_preview': database_context[:500] + "..." if len(database_context) > 500 else database_context,
         'keyword_matches_count': len(keyword_matches),
@@ -445,56 +628,30 @@ def debug_query():
 @app.route('/api/analytics/dashboard')
 def get_dashboard_stats():
     """Get dashboard statistics based on YOUR interventions database"""
-    stats = analytics.get_dashboard_stats()
-    return jsonify(stats)
+    # Polls get a 304 until the numbers actually change, even across recomputes
+    return conditional_ojsonify(get_analytics().get_dashboard_stats())
 
 @app.route('/api/analytics/interventions-usage')
 def get_interventions_usage():
     """Get how often interventions from YOUR database are being recommended"""
-    conn = sqlite3.connect(analytics.db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT 
-            qi.intervention_name,
-            qi.problem_type,
-            qi.category,
-            COUNT(*) as usage_count,
-            i.description as intervention_description
-        FROM query_interventions qi
-        GROUP BY qi.intervention_name, qi.problem_type, qi.category
-        ORDER BY usage_count DESC
-        LIMIT 15
-    ''')
-    
-    interventions_usage = []
-    for row in cursor.fetchall():
-        interventions_usage.append({
-            'intervention_name': row[0],
-            'problem_type': row[1],
-            'category': row[2],
-            'usage_count': row[3],
-            'description': row[4] if row[4] else "No description available"
-        })
-    
-    conn.close()
-    return jsonify({'interventions_usage': interventions_usage})
+    return ojsonify({'interventions_usage': get_analytics().get_interventions_usage()})
 
 if __name__ == '__main__':
     print("=" * 60)
     print("🚦 ROAD SAFETY INTERVENTION GPT - Web Interface")
     print("=" * 60)
     print(f"Current directory: {current_dir}")
-    print(f"Database path: {os.path.join(current_dir, 'data', 'processed_database.json')}")
-    print(f"Loaded {len(road_safety_gpt.database)} interventions from database")
+    print(f"Database path: {DB_PATH}")
+    print(f"Loaded {len(get_road_safety_gpt().database)} interventions from database")
     
     if test_connection():
         print("✓ Ollama connection successful")
         print("\nStarting Flask server...")
         print("Access the app at: http://localhost:5500")
+        print("(development server - use the Procfile's gunicorn command in production)")
         print("=" * 60)
-        app.run(debug=True, host='0.0.0.0', port=5500)
+        create_app().run(debug=True, host='0.0.0.0', port=5500)
     else:
         print("\nError: Cannot connect to Ollama")
         print("Please start Ollama with: ollama serve")
-        print("And make sure phi3:mini model is pulled: ollama pull phi3:mini")
\ No newline at end of file
+        print(f"And make sure {DEFAULT_MODEL} model is pulled: ollama pull {DEFAULT_MODEL}")
\ No newline at end of file
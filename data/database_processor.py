@@ -1,15 +1,99 @@
 import pandas as pd
+import functools
 import json
 import os
 import glob
+import re
+
+try:
+    import chardet
+except ImportError:
+    chardet = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMMON_TERMS = frozenset({
+    'speed', 'pedestrian', 'crossing', 'school', 'hospital', 'stop',
+    'warning', 'mandatory', 'informatory', 'prohibitory', 'urban',
+    'rural', 'highway', 'expressway', 'residential', 'commercial',
+    'damaged', 'missing', 'faded', 'placement', 'spacing', 'height',
+    'visibility', 'obstruction', 'non-standard', 'wrong colour',
+    'curve', 'curved', 'bend', 'chevron', 'sign', 'marking',
+})
+
+# (description keywords, road types they imply)
+ROAD_TYPE_RULES = (
+    (frozenset({'urban', 'city'}), ('Urban Arterial', 'Collector Road', 'Local Street')),
+    (frozenset({'highway', 'expressway', 'rural'}), ('Highway', 'Expressway', 'Rural Road')),
+    (frozenset({'residential'}), ('Residential Street',)),
+    (frozenset({'school'}), ('School Zone', 'Urban Arterial', 'Collector Road')),
+)
+
+# Used when no description keyword matched: (category substring, road types)
+CATEGORY_ROAD_TYPES = (
+    ('Road Sign', ('All Road Types',)),
+    ('Road Marking', ('All Road Types',)),
+    ('Traffic Calming', ('Local Street', 'Collector Road', 'Residential Area')),
+)
+
+# (description keywords, environments they imply)
+ENVIRONMENT_RULES = (
+    (frozenset({'school'}), ('Near Schools',)),
+    (frozenset({'hospital'}), ('Near Hospitals',)),
+    (frozenset({'residential'}), ('Residential Area',)),
+    (frozenset({'commercial'}), ('Commercial Area',)),
+    (frozenset({'pedestrian'}), ('High Pedestrian Activity',)),
+    (frozenset({'intersection', 'crossing'}), ('Intersections',)),
+)
+
+def compile_scanner(terms):
+    """Regex that finds every term in one pass, plus the terms each hit implies"""
+    # A lookahead tried at every position finds overlapping terms; longest first,
+    # so a term that starts inside the same match (curve in curved) is implied
+    ordered = sorted(set(terms), key=len, reverse=True)
+    regex = re.compile("(?=(" + "|".join(map(re.escape, ordered)) + "))")
+    implied = {term: frozenset(other for other in ordered if other in term) for term in ordered}
+    return regex, implied
+
+# The only CSV columns used; all but the serial number are read as text, so
+# pandas skips type inference and clauses like "2.10" keep their trailing zero
+SOURCE_COLUMNS = ['S. No.', 'problem', 'category', 'type', 'data', 'code', 'clause']
+SOURCE_DTYPES = {column: str for column in SOURCE_COLUMNS if column != 'S. No.'}
+
+ENCODINGS = ['utf-8', 'latin1', 'iso-8859-1', 'cp1252', 'utf-16']
+# Bytes chardet looks at; its guess settles long before the end of a big CSV
+SNIFF_BYTES = 64 * 1024
+
+# Rows read and converted at a time, so memory doesn't grow with the CSV
+CHUNK_ROWS = 10000
+
+# Everything any helper looks for, so each description is scanned only once
+DESCRIPTION_SCANNER = compile_scanner(
+    COMMON_TERMS.union(*(rule_keywords for rule_keywords, _ in ROAD_TYPE_RULES + ENVIRONMENT_RULES))
+)
+
+def label_lookup(rules):
+    """Flatten a rule table into keyword -> every label it implies"""
+    lookup = {}
+    for rule_keywords, labels in rules:
+        for keyword in rule_keywords:
+            lookup[keyword] = lookup.get(keyword, frozenset()) | frozenset(labels)
+    return lookup
+
+ROAD_TYPE_LABELS = label_lookup(ROAD_TYPE_RULES)
+ENVIRONMENT_LABELS = label_lookup(ENVIRONMENT_RULES)
 
 def get_project_root():
     """Get the absolute path to the project root"""
     current_dir = os.path.dirname(os.path.abspath(__file__))
     return os.path.dirname(current_dir)  
 
+@functools.lru_cache(maxsize=1)
 def find_csv_file():
-    """Find the CSV file automatically"""
+    """Find the CSV file automatically (searched once per process)"""
     project_root = get_project_root()
     
     possible_locations = [
@@ -31,10 +115,11 @@ def find_csv_file():
             print(f"Found CSV file: {location}")
             return location
     for location in csv_search_locations:
-        files = glob.glob(location)
-        if files:
-            print(f"Found CSV file: {files[0]}")
-            return files[0]
+        # Stop at the first hit instead of listing the whole directory
+        found = next(glob.iglob(location), None)
+        if found:
+            print(f"Found CSV file: {found}")
+            return found
     
     print("Could not find CSV file. Please make sure your CSV file is in one of these locations:")
     for loc in possible_locations + csv_search_locations:
@@ -42,16 +127,19 @@ def find_csv_file():
     return None
 
 def process_database():
+    """Convert the interventions CSV into data/processed_database.json; returns the record count"""
     csv_file_path = find_csv_file()
     
     if not csv_file_path:
-        return []
-    encodings = ['utf-8', 'latin1', 'iso-8859-1', 'cp1252', 'utf-16']
-    
-    for encoding in encodings:
+        return 0
+    project_root = get_project_root()
+    output_dir = os.path.join(project_root, 'data')
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, 'processed_database.json')
+    for encoding in candidate_encodings(csv_file_path):
         try:
             print(f"Trying encoding: {encoding}")
-            df = pd.read_csv(csv_file_path, encoding=encoding)
+            count, sample = write_database(csv_file_path, encoding, output_path)
             print(f"Success with encoding: {encoding}")
             break
         except UnicodeDecodeError:
@@ -61,114 +149,124 @@ def process_database():
             continue
     else:
         print("Could not read file with any encoding. Please check the file format.")
-        return []
-    
-    print(f"Successfully loaded CSV with {len(df)} rows")
-    print(f"Columns: {df.columns.tolist()}")
-    
-    processed_data = []
-    
-    for _, row in df.iterrows():
-        intervention = {
-            "intervention_id": row['S. No.'],
-            "problem_type": row['problem'],
-            "category": row['category'],
-            "intervention_name": row['type'],
-            "description": str(row['data']),
-            "standard_code": row['code'],
-            "clause": str(row['clause']),
-            "keywords": extract_keywords(row['problem'], row['type'], row['data']),
-            "road_types": infer_road_types(row['data'], row['category']),
-            "environments": infer_environments(row['data'], row['category'])
-        }
-        processed_data.append(intervention)
-    project_root = get_project_root()
-    output_dir = os.path.join(project_root, 'data')
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, 'processed_database.json')
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(processed_data, f, indent=2)
+        return 0
     
-    print(f"Processed {len(processed_data)} interventions")
+    print(f"Processed {count} interventions")
     print(f"Saved to: {output_path}")
-    if processed_data:
+    if sample:
         print("\nSample intervention:")
-        print(json.dumps(processed_data[0], indent=2))
-    
-    return processed_data
-
-def extract_keywords(problem, intervention_type, description):
-    """Extract relevant keywords"""
-    keywords = []
-    if isinstance(problem, str):
-        keywords.extend(problem.lower().split())
-    if isinstance(intervention_type, str):
-        keywords.extend(intervention_type.lower().split())
-    common_terms = ['speed', 'pedestrian', 'crossing', 'school', 'hospital', 'stop', 
-                   'warning', 'mandatory', 'informatory', 'prohibitory', 'urban', 
-                   'rural', 'highway', 'expressway', 'residential', 'commercial',
-                   'damaged', 'missing', 'faded', 'placement', 'spacing', 'height',
-                   'visibility', 'obstruction', 'non-standard', 'wrong colour',
-                   'curve', 'curved', 'bend', 'chevron', 'sign', 'marking']
+        print(json.dumps(sample, indent=2))
     
-    if isinstance(description, str):
-        description_lower = description.lower()
-        for term in common_terms:
-            if term in description_lower:
-                keywords.append(term)
+    return count
+
+def candidate_encodings(csv_file_path):
+    """ENCODINGS in the order to try them, chardet's guess (if any) first"""
+    if chardet is None:
+        return ENCODINGS
+    with open(csv_file_path, 'rb') as f:
+        guess = chardet.detect(f.read(SNIFF_BYTES))
+    if not guess['encoding'] or guess['confidence'] < 0.5:
+        return ENCODINGS
+    best = guess['encoding'].lower()
+    print(f"Detected encoding: {best} (confidence {guess['confidence']:.2f})")
+    return [best] + [encoding for encoding in ENCODINGS if encoding != best]
+
+def write_database(csv_file_path, encoding, output_path):
+    """Stream the CSV, CHUNK_ROWS at a time, into a JSON array at output_path"""
+    # Built beside the target and moved over it only once every chunk has decoded
+    tmp_path = output_path + '.tmp'
+    count = 0
+    sample = None
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(b'[')
+            chunks = pd.read_csv(csv_file_path, encoding=encoding, usecols=SOURCE_COLUMNS,
+                                 dtype=SOURCE_DTYPES, chunksize=CHUNK_ROWS)
+            for i, df in enumerate(chunks):
+                if i == 0:
+                    print(f"Columns: {df.columns.tolist()}")
+                for record in process_chunk(df):
+                    f.write(b',\n' if count else b'\n')
+                    f.write(dump_record(record))
+                    sample = sample or record
+                    count += 1
+            f.write(b'\n]\n')
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return count, sample
+
+def dump_record(record):
+    """One record as compact UTF-8 JSON, through orjson when it's installed"""
+    if orjson is not None:
+        return orjson.dumps(record)
+    return json.dumps(record, ensure_ascii=False).encode('utf-8')
+
+def process_chunk(df):
+    """Intervention records for one chunk of CSV rows"""
+    # Whole-column work: lowercase once, then one regex pass per description
+    # whose hits all three helpers share
+    problems = lower_text(df['problem'])
+    types = lower_text(df['type'])
+    description_hits = term_hits(lower_text(df['data']), DESCRIPTION_SCANNER)
+    keywords = extract_keywords(problems, types, description_hits)
+    road_types = infer_road_types(description_hits, df['category'])
+    environments = infer_environments(description_hits)
     
-    return list(set(keywords))
+    return [
+        {
+            "intervention_id": sno,
+            "problem_type": problem,
+            "category": category,
+            "intervention_name": intervention_type,
+            "description": str(data),
+            "standard_code": code,
+            "clause": str(clause),
+            "keywords": kw,
+            "road_types": rt,
+            "environments": env
+        }
+        for (sno, problem, category, intervention_type, data, code, clause), kw, rt, env in zip(
+            df[SOURCE_COLUMNS].itertuples(index=False, name=None),
+            keywords, road_types, environments
+        )
+    ]
+
+def lower_text(column):
+    """Lowercased text of every cell; '' where the cell is missing or not text"""
+    if not (pd.api.types.is_object_dtype(column) or pd.api.types.is_string_dtype(column)):
+        return pd.Series('', index=column.index)
+    return column.str.lower().fillna('')
+
+def term_hits(descriptions, scanner):
+    """For each row, the set of scanner terms contained in its lowercased description"""
+    regex, implied = scanner
+    return [set().union(*(implied[term] for term in found)) for found in descriptions.str.findall(regex)]
+
+def rule_labels(description_hits, lookup):
+    """For each row, the set of labels its description keywords imply"""
+    return [set().union(*(lookup[hit] for hit in hits if hit in lookup)) for hits in description_hits]
+
+def extract_keywords(problems, types, description_hits):
+    """Extract relevant keywords for every row"""
+    return [list((hits & COMMON_TERMS).union(problem, intervention_type))
+            for problem, intervention_type, hits in zip(
+                problems.str.split(), types.str.split(), description_hits)]
 
-def infer_road_types(description, category):
-    """Infer suitable road types"""
+def infer_road_types(description_hits, categories):
+    """Infer suitable road types for every row"""
     road_types = []
-    
-    if isinstance(description, str):
-        desc_lower = description.lower()
-        
-        if 'urban' in desc_lower or 'city' in desc_lower:
-            road_types.extend(['Urban Arterial', 'Collector Road', 'Local Street'])
-        if 'highway' in desc_lower or 'expressway' in desc_lower or 'rural' in desc_lower:
-            road_types.extend(['Highway', 'Expressway', 'Rural Road'])
-        if 'residential' in desc_lower:
-            road_types.append('Residential Street')
-        if 'school' in desc_lower:
-            road_types.extend(['School Zone', 'Urban Arterial', 'Collector Road'])
-    if not road_types:
-        if isinstance(category, str):
-            if 'Road Sign' in category:
-                road_types = ['All Road Types']
-            elif 'Road Marking' in category:
-                road_types = ['All Road Types']
-            elif 'Traffic Calming' in category:
-                road_types = ['Local Street', 'Collector Road', 'Residential Area']
-    
-    return list(set(road_types)) if road_types else ['General']
+    for labels, category in zip(rule_labels(description_hits, ROAD_TYPE_LABELS), categories.tolist()):
+        if not labels and isinstance(category, str):
+            labels = next((fallback for name, fallback in CATEGORY_ROAD_TYPES if name in category), ())
+        road_types.append(list(labels) if labels else ['General'])
+    return road_types
 
-def infer_environments(description, category):
-    """Infer suitable environments"""
-    environments = []
-    
-    if isinstance(description, str):
-        desc_lower = description.lower()
-        
-        if 'school' in desc_lower:
-            environments.append('Near Schools')
-        if 'hospital' in desc_lower:
-            environments.append('Near Hospitals')
-        if 'residential' in desc_lower:
-            environments.append('Residential Area')
-        if 'commercial' in desc_lower:
-            environments.append('Commercial Area')
-        if 'pedestrian' in desc_lower:
-            environments.append('High Pedestrian Activity')
-        if 'intersection' in desc_lower or 'crossing' in desc_lower:
-            environments.append('Intersections')
-    
-    if not environments:
-        environments = ['General']
-    
-    return list(set(environments))
+def infer_environments(description_hits):
+    """Infer suitable environments for every row"""
+    return [list(labels) if labels else ['General']
+            for labels in rule_labels(description_hits, ENVIRONMENT_LABELS)]
 
 if __name__ == "__main__":
     process_database()
\ No newline at end of file
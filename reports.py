@@ -1,5 +1,8 @@
 import os
 import json
+import glob
+import hashlib
+import tempfile
 from datetime import datetime
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
@@ -8,54 +11,162 @@ from reportlab.lib import colors
 from reportlab.lib.units import inch
 import openpyxl
 from openpyxl.styles import Font, Alignment, PatternFill
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
 import sqlite3
+import threading
+
+# Total plus the top interventions, problem types and categories. The inner
+# SELECTs are wrapped so each keeps its own ORDER BY / LIMIT
+ANALYTICS_SQL = '''
+    SELECT 'total', NULL, COUNT(*) FROM user_queries
+    UNION ALL
+    SELECT * FROM (
+        SELECT 'interventions', intervention_name, COUNT(*) as count
+        FROM query_interventions
+        GROUP BY intervention_name
+        ORDER BY count DESC
+        LIMIT 10
+    )
+    UNION ALL
+    SELECT * FROM (
+        SELECT 'problem_types', problem_type, COUNT(*) as count
+        FROM query_interventions
+        GROUP BY problem_type
+        ORDER BY count DESC
+        LIMIT 8
+    )
+    UNION ALL
+    SELECT * FROM (
+        SELECT 'categories', category, COUNT(*) as count
+        FROM query_interventions
+        GROUP BY category
+        ORDER BY count DESC
+        LIMIT 8
+    )
+'''
+
+# Checklist priority by category (anything else is Medium) - simple, can be enhanced
+PRIORITY_TABLE = {
+    'Traffic Signs': 'High',
+    'Road Markings': 'Medium',
+    'Pedestrian Facilities': 'High',
+    'Speed Management': 'High',
+    'Lighting': 'Medium',
+    'Drainage': 'Low'
+}
+
+# PDF styles, built once at import rather than on every report
+STYLES = getSampleStyleSheet()
+HEADING_STYLE = STYLES['Heading2']
+TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=STYLES['Heading1'],
+    fontSize=18,
+    spaceAfter=30,
+    textColor=colors.HexColor('#10a37f'),
+    alignment=1  # Center
+)
+DATE_STYLE = ParagraphStyle(
+    'DateStyle',
+    parent=STYLES['Normal'],
+    fontSize=10,
+    textColor=colors.gray,
+    alignment=1
+)
+SUMMARY_STYLE = ParagraphStyle(
+    'SummaryStyle',
+    parent=STYLES['Normal'],
+    fontSize=12,
+    spaceAfter=12,
+    textColor=colors.black
+)
+
+def table_style(header_color, body_color):
+    """Colored bold header row over a gridded body"""
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor(header_color)),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), body_color),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ])
+
+INTERVENTION_TABLE_STYLE = table_style('#10a37f', colors.beige)
+PROBLEM_TABLE_STYLE = table_style('#0d8c6c', colors.lightgrey)
+
+def header_cells(ws, headers, color):
+    """Build a bold white-on-color header row for a write-only sheet"""
+    cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = Font(bold=True, color='FFFFFF')
+        cell.fill = PatternFill(start_color=color, end_color=color, fill_type='solid')
+        cells.append(cell)
+    return cells
+
+class SheetRows:
+    """Rows for one write-only sheet, with each column's longest value tracked as they're added"""
+    def __init__(self, ws):
+        self.ws = ws
+        self.rows = []
+        self.widths = []
+    
+    def append(self, row):
+        for col, value in enumerate(row):
+            length = len(str(getattr(value, 'value', value)))
+            if col == len(self.widths):
+                self.widths.append(length)
+            elif length > self.widths[col]:
+                self.widths[col] = length
+        self.rows.append(row)
+    
+    def write(self):
+        """Size the columns (capped at 50), then stream the rows out"""
+        for col, width in enumerate(self.widths, 1):
+            self.ws.column_dimensions[get_column_letter(col)].width = min(width + 2, 50)
+        for row in self.rows:
+            self.ws.append(row)
 
 class ReportGenerator:
+    # Generated reports kept on disk per format; older ones are deleted
+    REPORT_CACHE_SIZE = 10
+    
     def __init__(self, data_dir='data'):
         self.data_dir = data_dir
         self.analytics_db_path = os.path.join(data_dir, 'analytics.db')
+        # One connection for the generator's lifetime so SQLite's page cache
+        # stays warm between reports; the lock serializes request threads
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.analytics_db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA cache_size=-65536')
+    
+    def close(self):
+        """Close the analytics database connection"""
+        self._conn.close()
         
     def get_analytics_data(self):
         """Get analytics data from SQLite database"""
-        conn = sqlite3.connect(self.analytics_db_path)
-        cursor = conn.cursor()
-        
-        # Get basic stats
-        cursor.execute('SELECT COUNT(*) FROM user_queries')
-        total_reports = cursor.fetchone()[0]
-        
-        # Get top interventions
-        cursor.execute('''
-            SELECT intervention_name, COUNT(*) as count 
-            FROM query_interventions 
-            GROUP BY intervention_name 
-            ORDER BY count DESC 
-            LIMIT 10
-        ''')
-        top_interventions = [{'name': row[0], 'count': row[1]} for row in cursor.fetchall()]
-        
-        # Get problem types
-        cursor.execute('''
-            SELECT problem_type, COUNT(*) as count 
-            FROM query_interventions 
-            GROUP BY problem_type 
-            ORDER BY count DESC 
-            LIMIT 8
-        ''')
-        problem_types = [{'name': row[0], 'count': row[1]} for row in cursor.fetchall()]
-        
-        # Get categories
-        cursor.execute('''
-            SELECT category, COUNT(*) as count 
-            FROM query_interventions 
-            GROUP BY category 
-            ORDER BY count DESC 
-            LIMIT 8
-        ''')
-        categories = [{'name': row[0], 'count': row[1]} for row in cursor.fetchall()]
+        with self._lock:
+            # All four figures in one statement: (section, name, count) rows
+            rows = self._conn.execute(ANALYTICS_SQL).fetchall()
+        
+        sections = {'interventions': [], 'problem_types': [], 'categories': []}
+        total_reports = 0
+        for section, name, count in rows:
+            if section == 'total':
+                total_reports = count
+            else:
+                sections[section].append({'name': name, 'count': count})
         
-        conn.close()
+        top_interventions = sections['interventions']
+        problem_types = sections['problem_types']
+        categories = sections['categories']
         
         return {
             'total_reports': total_reports,
@@ -65,122 +176,130 @@ class ReportGenerator:
             'generated_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
     
+    def report_path(self, data, ext):
+        """Path a report of this analytics data is cached under, keyed by its hash"""
+        stats = {key: value for key, value in data.items() if key != 'generated_date'}
+        digest = hashlib.sha1(json.dumps(stats, sort_keys=True).encode()).hexdigest()[:16]
+        return os.path.join(self.data_dir, f'report_{digest}.{ext}')
+    
+    def reuse_report(self, path):
+        """Whether a cached report exists at path, marking it newest so pruning keeps it"""
+        try:
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+    
+    def save_report(self, output_path, write):
+        """Have write(path) build the report in a fresh temporary file, then move it to output_path"""
+        # A unique file per build, so concurrent builds of the same report never
+        # write into each other and a half-written file is never published
+        fd, build_path = tempfile.mkstemp(prefix='report_', suffix='.tmp', dir=os.path.dirname(output_path) or '.')
+        os.close(fd)
+        try:
+            write(build_path)
+            os.replace(build_path, output_path)
+        finally:
+            if os.path.exists(build_path):
+                os.remove(build_path)
+    
+    def prune_reports(self, ext, keep):
+        """Delete all but the REPORT_CACHE_SIZE newest reports of a format, never keep itself"""
+        dated = []
+        for path in glob.glob(os.path.join(self.data_dir, f'report_*.{ext}')):
+            try:
+                dated.append((os.path.getmtime(path), path))
+            except OSError:
+                pass  # already removed by a concurrent prune
+        dated.sort(reverse=True)
+        for _, path in dated[self.REPORT_CACHE_SIZE:]:
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
     def generate_pdf_report(self, output_path=None):
-        """Generate PDF compliance report"""
-        if not output_path:
-            output_path = os.path.join(self.data_dir, f'report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf')
-        
+        """Generate PDF compliance report, reusing the cached one if the analytics haven't changed"""
         data = self.get_analytics_data()
         
-        doc = SimpleDocTemplate(output_path, pagesize=A4)
+        cached = not output_path
+        if cached:
+            output_path = self.report_path(data, 'pdf')
+            if self.reuse_report(output_path):
+                return output_path
+        
         story = []
-        styles = getSampleStyleSheet()
         
         # Title
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=18,
-            spaceAfter=30,
-            textColor=colors.HexColor('#10a37f'),
-            alignment=1  # Center
-        )
-        title = Paragraph("Road Safety Interventions Compliance Report", title_style)
+        title = Paragraph("Road Safety Interventions Compliance Report", TITLE_STYLE)
         story.append(title)
         
         # Date
-        date_style = ParagraphStyle(
-            'DateStyle',
-            parent=styles['Normal'],
-            fontSize=10,
-            textColor=colors.gray,
-            alignment=1
-        )
-        date_text = Paragraph(f"Generated on: {data['generated_date']}", date_style)
+        date_text = Paragraph(f"Generated on: {data['generated_date']}", DATE_STYLE)
         story.append(date_text)
         story.append(Spacer(1, 20))
         
         # Summary Stats
-        summary_style = ParagraphStyle(
-            'SummaryStyle',
-            parent=styles['Normal'],
-            fontSize=12,
-            spaceAfter=12,
-            textColor=colors.black
-        )
-        
-        story.append(Paragraph(f"<b>Total Reports Generated:</b> {data['total_reports']}", summary_style))
+        story.append(Paragraph(f"<b>Total Reports Generated:</b> {data['total_reports']}", SUMMARY_STYLE))
         story.append(Spacer(1, 10))
         
         # Top Interventions Table
-        story.append(Paragraph("<b>Most Recommended Interventions</b>", styles['Heading2']))
+        story.append(Paragraph("<b>Most Recommended Interventions</b>", HEADING_STYLE))
         intervention_data = [['Intervention', 'Recommendation Count']]
         for intervention in data['top_interventions']:
             intervention_data.append([intervention['name'], str(intervention['count'])])
         
         intervention_table = Table(intervention_data, colWidths=[4*inch, 1.5*inch])
-        intervention_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#10a37f')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
+        intervention_table.setStyle(INTERVENTION_TABLE_STYLE)
         story.append(intervention_table)
         story.append(Spacer(1, 20))
         
         # Problem Types
-        story.append(Paragraph("<b>Most Common Problem Types</b>", styles['Heading2']))
+        story.append(Paragraph("<b>Most Common Problem Types</b>", HEADING_STYLE))
         problem_data = [['Problem Type', 'Occurrence Count']]
         for problem in data['problem_types']:
             problem_data.append([problem['name'], str(problem['count'])])
         
         problem_table = Table(problem_data, colWidths=[4*inch, 1.5*inch])
-        problem_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0d8c6c')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.lightgrey),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
+        problem_table.setStyle(PROBLEM_TABLE_STYLE)
         story.append(problem_table)
         
-        doc.build(story)
+        self.save_report(output_path, lambda path: SimpleDocTemplate(path, pagesize=A4).build(story))
+        if cached:
+            self.prune_reports('pdf', keep=output_path)
         return output_path
     
     def generate_excel_report(self, output_path=None):
-        """Generate Excel report with analytics and cost estimation"""
-        if not output_path:
-            output_path = os.path.join(self.data_dir, f'report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx')
-        
+        """Generate Excel report with analytics and cost estimation, reusing the cached one if unchanged"""
         data = self.get_analytics_data()
         
-        wb = openpyxl.Workbook()
+        cached = not output_path
+        if cached:
+            output_path = self.report_path(data, 'xlsx')
+            if self.reuse_report(output_path):
+                return output_path
         
-        # Summary Sheet
-        ws_summary = wb.active
-        ws_summary.title = "Summary"
-        
-        # Header - Don't merge cells to avoid the error
-        ws_summary['A1'] = "Road Safety Interventions Analytics Report"
-        ws_summary['A1'].font = Font(size=16, bold=True, color='FF10A37F')
-        ws_summary['A1'].alignment = Alignment(horizontal='center')
+        # Write-only workbook: rows stream out to the file instead of being kept as cell objects
+        wb = openpyxl.Workbook(write_only=True)
         
-        ws_summary['A3'] = "Generated on:"
-        ws_summary['B3'] = data['generated_date']
-        ws_summary['A4'] = "Total Reports:"
-        ws_summary['B4'] = data['total_reports']
+        # Summary Sheet
+        ws_summary = wb.create_sheet("Summary")
+        title = WriteOnlyCell(ws_summary, value="Road Safety Interventions Analytics Report")
+        title.font = Font(size=16, bold=True, color='FF10A37F')
+        title.alignment = Alignment(horizontal='center')
+        summary_rows = SheetRows(ws_summary)
+        summary_rows.append([title])
+        summary_rows.append([])
+        summary_rows.append(["Generated on:", data['generated_date']])
+        summary_rows.append(["Total Reports:", data['total_reports']])
         
         # Top Interventions Sheet
         ws_interventions = wb.create_sheet("Top Interventions")
         headers = ['Intervention', 'Recommendation Count', 'Priority Level', 'Estimated Cost']
-        ws_interventions.append(headers)
+        intervention_rows = SheetRows(ws_interventions)
+        intervention_rows.append(header_cells(ws_interventions, headers, '10A37F'))
         
         # Add sample cost estimation and priority
         cost_ranges = {
@@ -201,23 +320,18 @@ class ReportGenerator:
                 priority = 'Low'
                 cost = cost_ranges['low']
                 
-            ws_interventions.append([
+            intervention_rows.append([
                 intervention['name'],
                 intervention['count'],
                 priority,
                 cost
             ])
         
-        # Style the interventions sheet
-        for col in range(1, len(headers) + 1):
-            cell = ws_interventions.cell(row=1, column=col)
-            cell.font = Font(bold=True, color='FFFFFF')
-            cell.fill = PatternFill(start_color='10A37F', end_color='10A37F', fill_type='solid')
-        
         # Problem Types Sheet
         ws_problems = wb.create_sheet("Problem Types")
         problem_headers = ['Problem Type', 'Occurrence Count', 'Severity Level']
-        ws_problems.append(problem_headers)
+        problem_rows = SheetRows(ws_problems)
+        problem_rows.append(header_cells(ws_problems, problem_headers, '0D8C6C'))
         
         for problem in data['problem_types']:
             # Severity based on occurrence
@@ -228,30 +342,15 @@ class ReportGenerator:
             else:
                 severity = 'Medium'
                 
-            ws_problems.append([problem['name'], problem['count'], severity])
+            problem_rows.append([problem['name'], problem['count'], severity])
         
-        # Style problems sheet
-        for col in range(1, len(problem_headers) + 1):
-            cell = ws_problems.cell(row=1, column=col)
-            cell.font = Font(bold=True, color='FFFFFF')
-            cell.fill = PatternFill(start_color='0D8C6C', end_color='0D8C6C', fill_type='solid')
+        # Write-only sheets need their column widths before the first row
+        for rows in (summary_rows, intervention_rows, problem_rows):
+            rows.write()
         
-        # Auto-adjust column widths (FIXED VERSION)
-        for sheet_name in wb.sheetnames:
-            ws = wb[sheet_name]
-            for column_cells in ws.columns:
-                max_length = 0
-                column = column_cells[0].column_letter  # Get column letter from first cell
-                for cell in column_cells:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)  # Cap at 50
-                ws.column_dimensions[column].width = adjusted_width
-        
-        wb.save(output_path)
+        self.save_report(output_path, wb.save)
+        if cached:
+            self.prune_reports('xlsx', keep=output_path)
         return output_path
     
     def generate_compliance_checklist(self, interventions):
@@ -274,16 +373,7 @@ class ReportGenerator:
         
         return checklist
     
-    def _calculate_priority(self, intervention):
+    @staticmethod
+    def _calculate_priority(intervention):
         """Calculate priority based on intervention characteristics"""
-        # Simple priority calculation - can be enhanced
-        priority_factors = {
-            'Traffic Signs': 'High',
-            'Road Markings': 'Medium', 
-            'Pedestrian Facilities': 'High',
-            'Speed Management': 'High',
-            'Lighting': 'Medium',
-            'Drainage': 'Low'
-        }
-        
-        return priority_factors.get(intervention['category'], 'Medium')
\ No newline at end of file
+        return PRIORITY_TABLE.get(intervention['category'], 'Medium')
\ No newline at end of file
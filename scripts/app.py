@@ -1,102 +1,37 @@
-import json
 import os
 import sys
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)  
-sys.path.append(parent_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
 
-from ollama_client import OllamaClient, test_connection
+from scripts.ollama_client import DEFAULT_MODEL, test_connection
+from scripts.road_safety_gpt import get_road_safety_gpt
 
-class RoadSafetyGPT:
+class RoadSafetyCLI:
+    """Terminal front end for the same RoadSafetyGPT engine the web app uses"""
     def __init__(self):
-        self.client = OllamaClient()
-        self.database = self.load_database()
-        self.system_prompt = self.load_system_prompt()
-    
-    def load_database(self):
-        """Load the processed interventions database"""
-        try:
-            db_path = os.path.join(parent_dir, 'data', 'processed_database.json')
-            print(f"Looking for database at: {db_path}")
-            
-            with open(db_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                print(f"Successfully loaded {len(data)} interventions")
-                return data
-        except FileNotFoundError:
-            print("Error: Processed database not found.")
+        self.gpt = get_road_safety_gpt()
+        if not self.gpt.database:
             print("Please run: python3 data/database_processor.py")
             sys.exit(1)
-        except Exception as e:
-            print(f"Error loading database: {e}")
-            sys.exit(1)
-    
-    def load_system_prompt(self):
-        """Load the system prompt"""
-        try:
-            prompt_path = os.path.join(parent_dir, 'prompts', 'system_prompt.txt')
-            print(f"Looking for system prompt at: {prompt_path}")
-            
-            with open(prompt_path, 'r', encoding='utf-8') as f:
-                prompt = f.read()
-                print("System prompt loaded successfully")
-                return prompt
-        except FileNotFoundError:
-            print("Error: System prompt not found.")
-            print("Please create prompts/system_prompt.txt")
-            sys.exit(1)
-    
-    def prepare_database_context(self):
-        """Prepare the database context for the AI"""
-        context = "ROAD SAFETY INTERVENTIONS DATABASE:\n\n"
-        
-        for intervention in self.database[:8]:  
-            context += f"ID: {intervention['intervention_id']}\n"
-            context += f"Problem Type: {intervention['problem_type']}\n"
-            context += f"Category: {intervention['category']}\n"
-            context += f"Intervention: {intervention['intervention_name']}\n"
-            context += f"Description: {intervention['description'][:200]}...\n"
-            context += f"Standard: {intervention['standard_code']} Clause {intervention['clause']}\n"
-            context += "-" * 50 + "\n"
-        
-        return context
-    
-    def search_interventions(self, user_query):
-        """Simple keyword-based search as fallback"""
-        query_lower = user_query.lower()
-        matches = []
-        
-        for intervention in self.database:
-            score = 0
-            if intervention['problem_type'].lower() in query_lower:
-                score += 3
-            for keyword in intervention['keywords']:
-                if keyword in query_lower:
-                    score += 1
-            if intervention['intervention_name'].lower() in query_lower:
-                score += 2
-            
-            if score > 0:
-                matches.append((score, intervention))
-        
-        matches.sort(key=lambda x: x[0], reverse=True)
-        return [match[1] for match in matches[:3]]
     
     def run(self):
         """Main application loop"""
         print("=" * 60)
         print("🚦 ROAD SAFETY INTERVENTION GPT")
         print("=" * 60)
-        print(f"Loaded {len(self.database)} interventions from database")
+        print(f"Loaded {len(self.gpt.database)} interventions from database")
         print("Type 'quit' to exit\n")
         
         if not test_connection():
             print("\nPlease start Ollama with: ollama serve")
-            print("And make sure phi3:mini model is pulled: ollama pull phi3:mini")
+            print(f"And make sure {DEFAULT_MODEL} model is pulled: ollama pull {DEFAULT_MODEL}")
             return
         
-        database_context = self.prepare_database_context()
+        # Loads the model while the user types their first question
+        self.gpt.client.warm_up()
         
         while True:
             user_input = input("\nDescribe the road safety problem: ").strip()
@@ -112,20 +47,19 @@ class RoadSafetyGPT:
             print("Analyzing your road safety issue...")
             print("=" * 40)
             
-            response = self.client.query_road_safety(
-                user_input, 
-                database_context, 
-                self.system_prompt
-            )
+            result = self.gpt.stream_response(user_input)
             
             print("\nRECOMMENDED INTERVENTIONS:")
             print("=" * 40)
-            print(response)
+            # Printed as Ollama generates it rather than after the whole reply
+            for chunk in result['ai_response']:
+                print(chunk, end="", flush=True)
+            print()
             
             print("\n" + "=" * 40)
             print("QUICK KEYWORD MATCHES:")
             print("=" * 40)
-            keyword_matches = self.search_interventions(user_input)
+            keyword_matches = result['keyword_matches']
             if keyword_matches:
                 for i, match in enumerate(keyword_matches, 1):
                     print(f"{i}. {match['intervention_name']} ({match['category']})")
@@ -136,5 +70,5 @@ class RoadSafetyGPT:
                 print("No direct keyword matches found.")
 
 if __name__ == "__main__":
-    app = RoadSafetyGPT()
-    app.run()
\ No newline at end of file
+    app = RoadSafetyCLI()
+    app.run()
@@ -1,42 +1,121 @@
+import os
+import threading
+import time
 import requests
 import json
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Model used for generation, e.g. OLLAMA_MODEL=llama3.1:8b
+DEFAULT_MODEL = os.environ.get("OLLAMA_MODEL", "phi3:mini")
+
+# Models Ollama reported at the last successful startup check, trusted for
+# MODELS_CACHE_TTL seconds so quick restarts skip the /api/tags probe
+MODELS_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "road_safety_gpt", "models.json")
+MODELS_CACHE_TTL = 300
+
+def encode_json(payload):
+    """Request body bytes, through orjson when it's installed (prompts can be tens of KB)"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode('utf-8')
+
+def decode_json(data):
+    """Parse a response body or stream line"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 class OllamaClient:
-    def __init__(self, base_url="http://localhost:11434"):
+    # Kept-alive connections to Ollama; one per gunicorn request thread
+    POOL_SIZE = 32
+    # Reply length cap, and a context window that fits the system prompt, the
+    # ~800-token database context, the query and the reply. Kept fixed: a
+    # different num_ctx per request makes Ollama reload the model
+    NUM_PREDICT = 512
+    NUM_CTX = 4096
+    # How long Ollama keeps the model loaded after each request
+    KEEP_ALIVE = "30m"
+    
+    def __init__(self, base_url="http://localhost:11434", model=None):
         self.base_url = base_url
-        self.model = "phi3:mini"
+        self.model = model or DEFAULT_MODEL
+        # Reuses connections across calls instead of a new TCP handshake per query
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=self.POOL_SIZE))
+        # Bodies are pre-encoded bytes (data=), so the type is set here
+        self.session.headers["Content-Type"] = "application/json"
     
-    def query_road_safety(self, user_query, database_context, system_prompt):
+    def build_prompt(self, user_query, database_context):
         """
-        Send query to Ollama with road safety context
+        Combine the database context and the user's query into one prompt
         """
-        # Prepare the full prompt
-        full_prompt = f"""
+        return f"""
 {database_context}
 
 USER QUERY: {user_query}
 
 Please analyze the road safety problem and recommend appropriate interventions from the database above.
 """
+    
+    def build_payload(self, full_prompt, system_prompt, stream=False):
+        """
+        Request body for Ollama's /api/generate. The unchanging system prompt
+        leads the prompt, so Ollama's prompt cache reuses it across queries
+        """
+        return {
+            "model": self.model,
+            "prompt": full_prompt,
+            "system": system_prompt,
+            "stream": stream,
+            "keep_alive": self.KEEP_ALIVE,
+            "options": {
+                "temperature": 0.1,  
+                "top_p": 0.9,
+                "num_predict": self.NUM_PREDICT,
+                "num_ctx": self.NUM_CTX
+            }
+        }
+    
+    def warm_up(self):
+        """Start loading the model in the background, so the first real query doesn't wait for it"""
+        # An empty prompt makes Ollama load the model without generating. Same
+        # num_ctx as real queries, or the first one would reload it
+        payload = {
+            "model": self.model,
+            "prompt": "",
+            "stream": False,
+            "keep_alive": self.KEEP_ALIVE,
+            "options": {"num_ctx": self.NUM_CTX}
+        }
+        
+        def load():
+            try:
+                self.session.post(f"{self.base_url}/api/generate", data=encode_json(payload), timeout=120)
+            except requests.exceptions.RequestException:
+                pass
+        
+        threading.Thread(target=load, daemon=True).start()
+    
+    def query_road_safety(self, user_query, database_context, system_prompt):
+        """
+        Send query to Ollama with road safety context
+        """
+        full_prompt = self.build_prompt(user_query, database_context)
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": full_prompt,
-                    "system": system_prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.1,  
-                        "top_p": 0.9
-                    }
-                },
+                data=encode_json(self.build_payload(full_prompt, system_prompt)),
                 timeout=120  
             )
             
             if response.status_code == 200:
-                return response.json()["response"]
+                return decode_json(response.content)["response"]
             else:
                 return f"Error: {response.status_code} - {response.text}"
                 
@@ -44,22 +123,83 @@ Please analyze the road safety problem and recommend appropriate interventions f
             return "Error: Cannot connect to Ollama. Please make sure Ollama is running on localhost:11434"
         except Exception as e:
             return f"Error: {str(e)}"
+    
+    def query_road_safety_stream(self, user_query, database_context, system_prompt):
+        """
+        Same as query_road_safety, but yields the reply piece by piece as Ollama generates it
+        """
+        full_prompt = self.build_prompt(user_query, database_context)
+        
+        try:
+            with self.session.post(
+                f"{self.base_url}/api/generate",
+                data=encode_json(self.build_payload(full_prompt, system_prompt, stream=True)),
+                stream=True,
+                timeout=120
+            ) as response:
+                if response.status_code != 200:
+                    yield f"Error: {response.status_code} - {response.text}"
+                    return
+                
+                # Ollama streams one JSON object per line
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = decode_json(line)
+                    if chunk.get("response"):
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        break
+                        
+        except requests.exceptions.ConnectionError:
+            yield "Error: Cannot connect to Ollama. Please make sure Ollama is running on localhost:11434"
+        except Exception as e:
+            yield f"Error: {str(e)}"
+
+def has_model(model_names, model):
+    """Whether any of Ollama's model names is (a tag of) model"""
+    return any(model.lower() in name.lower() for name in model_names)
+
+def cached_models(base_url):
+    """Model names saved for base_url within MODELS_CACHE_TTL, else []"""
+    try:
+        if time.time() - os.path.getmtime(MODELS_CACHE_PATH) > MODELS_CACHE_TTL:
+            return []
+        with open(MODELS_CACHE_PATH, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        return cache["models"] if cache.get("base_url") == base_url else []
+    except (OSError, ValueError, KeyError, AttributeError):
+        return []
+
+def save_models(base_url, model_names):
+    """Remember Ollama's model list; failing to write just means probing next time"""
+    try:
+        os.makedirs(os.path.dirname(MODELS_CACHE_PATH), exist_ok=True)
+        with open(MODELS_CACHE_PATH, 'w', encoding='utf-8') as f:
+            json.dump({"base_url": base_url, "models": model_names}, f)
+    except OSError:
+        pass
 
-def test_connection():
-    """Test if Ollama is running and phi3:mini model is available"""
-    client = OllamaClient()
+def test_connection(model=None, use_cache=True):
+    """Test if Ollama is running and the model (default OLLAMA_MODEL / phi3:mini) is available"""
+    client = OllamaClient(model=model)
+    # Only a recent positive result is reused; anything else probes again
+    if use_cache and has_model(cached_models(client.base_url), client.model):
+        print(f"{client.model} model found (checked in the last {MODELS_CACHE_TTL // 60} minutes)")
+        return True
     try:
-        response = requests.get(f"{client.base_url}/api/tags", timeout=10)
+        response = client.session.get(f"{client.base_url}/api/tags", timeout=10)
         if response.status_code == 200:
-            models = response.json().get("models", [])
+            models = decode_json(response.content).get("models", [])
             model_names = [model.get("name", "") for model in models]
             print("Available models:", model_names)
             
-            if any("phi3:mini" in name.lower() for name in model_names):
-                print("phi3:mini model found!")
+            if has_model(model_names, client.model):
+                print(f"{client.model} model found!")
+                save_models(client.base_url, model_names)
                 return True
             else:
-                print("phi3:mini model not found. Available models:", model_names)
+                print(f"{client.model} model not found. Available models:", model_names)
                 return False
         else:
             print("✗ Cannot connect to Ollama")
@@ -70,4 +210,4 @@ def test_connection():
         return False
 
 if __name__ == "__main__":
-    test_connection()
\ No newline at end of file
+    test_connection(use_cache=False)
\ No newline at end of file
@@ -0,0 +1,503 @@
+import functools
+import hashlib
+import json
+import mmap
+import os
+import re
+import sqlite3
+import textwrap
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+
+import numpy as np
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+from scripts.ollama_client import OllamaClient
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+
+DB_PATH = os.path.join(parent_dir, 'data', 'processed_database.json')
+PROMPT_PATH = os.path.join(parent_dir, 'prompts', 'system_prompt.txt')
+
+# Set DEBUG=1 to print where the database and prompt are loaded from
+DEBUG = bool(os.environ.get("DEBUG"))
+
+TOKEN_RE = re.compile(r"\w+")
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# Quantized intervention embeddings from the last start, reused while the
+# database file and model are unchanged
+EMBEDDING_CACHE = os.path.join(parent_dir, 'data', 'embeddings_cache.npz')
+# Finished replies persisted across restarts and shared by gunicorn workers
+RESPONSE_DB_PATH = os.path.join(parent_dir, 'data', 'response_cache.db')
+
+CONTEXT_HEADER = "RELEVANT ROAD SAFETY INTERVENTIONS:\n\n"
+
+PRIORITY_MAP = {
+    'Traffic Signs': 'High',
+    'Road Markings': 'Medium',
+    'Pedestrian Facilities': 'High',
+    'Speed Management': 'High',
+    'Lighting': 'Medium',
+    'Drainage': 'Low'
+}
+
+COST_RANGES = {
+    'High': '₹2,00,000 - ₹10,00,000',
+    'Medium': '₹50,000 - ₹2,00,000',
+    'Low': '₹5,000 - ₹50,000'
+}
+
+TIMELINE_MAP = {
+    'High': '1-2 weeks',
+    'Medium': '2-4 weeks',
+    'Low': '4-8 weeks'
+}
+
+@functools.lru_cache(maxsize=1024)
+def normalize_query(user_query):
+    """Lowercase a query and collapse its whitespace (cached for repeat questions)"""
+    return " ".join(user_query.lower().split())
+
+def quantize_rows(matrix):
+    """Symmetric int8 quantization with one float scale per row"""
+    scales = np.abs(matrix).max(axis=1) / 127
+    scales[scales == 0] = 1
+    quantized = np.clip(np.round(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+class RoadSafetyGPT:
+    # Finished LLM replies kept for repeat questions, keyed by (query, context)
+    RESPONSE_CACHE_SIZE = 512
+    # Age after which a reply in RESPONSE_DB_PATH is no longer served
+    RESPONSE_CACHE_TTL = 7 * 24 * 3600
+    # Hybrid ranking: cosine similarity counts this many keyword points, and
+    # interventions with no keyword hit need at least SEMANTIC_MIN_SIMILARITY
+    SEMANTIC_WEIGHT = 10
+    SEMANTIC_MIN_SIMILARITY = 0.35
+    # Prompt context budget, counting a token as ~4 characters. The top
+    # FULL_CONTEXT_BLOCKS matches get their description, the rest a one-line
+    # summary, up to CONTEXT_BLOCKS interventions in all
+    MAX_CTX_TOKENS = 800
+    FULL_CONTEXT_BLOCKS = 3
+    CONTEXT_BLOCKS = 8
+    # Descriptions in context blocks are cut to about this many characters at a
+    # word boundary; the full text stays on the record for the API and embeddings
+    CONTEXT_DESCRIPTION_CHARS = 300
+    
+    def __init__(self):
+        self.client = OllamaClient()
+        # Modification time of the loaded database file (0 if there isn't one)
+        self.db_mtime = 0
+        self._response_cache = OrderedDict()
+        self._response_lock = threading.Lock()
+        # key -> Future for replies currently being generated
+        self._inflight = {}
+        self.database = self.load_database()
+        self.system_prompt = self.load_system_prompt()
+        self._response_db_lock = threading.Lock()
+        self._response_db = self.open_response_db()
+        # Context for queries that match nothing: the leading interventions, built once
+        self._fallback_context = self.build_context(self.database)
+        self.automaton = self.build_automaton()
+        self.keyword_index = self.build_keyword_index() if self.automaton is None else None
+        self.embedder, self.embeddings, self.embedding_scales = self.build_embeddings()
+    
+    def load_database(self):
+        """Load the processed interventions database"""
+        try:
+            if DEBUG:
+                print(f"Looking for database at: {DB_PATH}")
+                print(f"File exists: {os.path.exists(DB_PATH)}")
+            
+            with open(DB_PATH, 'rb') as f:
+                self.db_mtime = os.fstat(f.fileno()).st_mtime
+                if orjson and os.fstat(f.fileno()).st_size:
+                    # orjson parses straight from the mapped pages, no bytes copy
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                        data = orjson.loads(view)
+                else:
+                    data = json.loads(f.read())
+        except FileNotFoundError:
+            print("Error: Processed database not found.")
+            print(f"Expected at: {DB_PATH}")
+            print("Please check if the file exists at this location.")
+            return []
+        
+        # Request-time display fields, built once; the search-only
+        # lowercased fields are columns local to collect_patterns
+        for iv in data:
+            iv['_description_short'] = textwrap.shorten(
+                iv['description'], width=self.CONTEXT_DESCRIPTION_CHARS, placeholder=" …")
+            iv['_ctx_snippet'] = (
+                f"{iv['intervention_name']}\n"
+                f"   Problem Type: {iv['problem_type']}\n"
+                f"   Category: {iv['category']}\n"
+                f"   Standard: {iv['standard_code']} Clause {iv['clause']}\n"
+                f"   Description: {iv['_description_short']}\n"
+                + "─" * 50 + "\n"
+            )
+            iv['_ctx_brief'] = (
+                f"{iv['intervention_name']} ({iv['problem_type']}, {iv['category']}): "
+                f"{iv['standard_code']} Clause {iv['clause']}\n"
+            )
+            iv['_priority'] = PRIORITY_MAP.get(iv.get('category', ''), 'Medium')
+            iv['_cost'] = COST_RANGES[iv['_priority']]
+            iv['_timeline'] = TIMELINE_MAP[iv['_priority']]
+        return data
+    
+    def load_system_prompt(self):
+        """Load the system prompt"""
+        try:
+            if DEBUG:
+                print(f"Looking for system prompt at: {PROMPT_PATH}")
+            
+            with open(PROMPT_PATH, 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            print("Warning: System prompt not found, using default")
+            return "You are a Road Safety Expert AI assistant."
+    
+    def prepare_database_context(self, user_query="", keyword_matches=None):
+        """Prepare focused database context for the AI"""
+        # Callers that already searched pass their matches to skip a second scan
+        if keyword_matches is None:
+            keyword_matches = self.search_interventions(user_query)
+        if not keyword_matches:
+            return self._fallback_context
+        return self.build_context(keyword_matches)
+    
+    def build_context(self, ranked):
+        """Context blocks for the best-ranked interventions that fit MAX_CTX_TOKENS"""
+        parts = [CONTEXT_HEADER]
+        budget = self.MAX_CTX_TOKENS * 4 - len(CONTEXT_HEADER)
+        for rank, iv in enumerate(ranked[:self.CONTEXT_BLOCKS]):
+            block = iv['_ctx_snippet']
+            # The best match always goes in whole; later ones shrink to a summary
+            if rank >= self.FULL_CONTEXT_BLOCKS or (rank and len(block) > budget):
+                block = iv['_ctx_brief']
+            if rank and len(block) > budget:
+                break
+            parts.append(block)
+            budget -= len(block)
+        return "".join(parts)
+    
+    def collect_patterns(self):
+        """Map every searchable pattern to its [(intervention index, weight), ...]"""
+        # Lowercased a column at a time; nothing here is kept on the records,
+        # since only the automaton / index built from it is queried
+        db = self.database
+        columns = (
+            ([(iv['problem_type'].lower(),) for iv in db], 10),
+            ([(iv['intervention_name'].lower(),) for iv in db], 8),
+            ([(iv['category'].lower(),) for iv in db], 5),
+            ([frozenset(k.lower() for k in iv['keywords']) for iv in db], 2),
+            ([frozenset(r.lower() for r in iv['road_types']) for iv in db], 3),
+            ([frozenset(e.lower() for e in iv['environments']) for iv in db], 3),
+        )
+        patterns = {}
+        for i in range(len(db)):
+            for column, weight in columns:
+                for pattern in column[i]:
+                    if pattern:
+                        patterns.setdefault(pattern, []).append((i, weight))
+        return patterns
+    
+    def build_automaton(self):
+        """Build one Aho-Corasick automaton over every searchable pattern"""
+        if ahocorasick is None:
+            print("pyahocorasick not installed, using inverted-index keyword search")
+            return None
+        
+        automaton = ahocorasick.Automaton()
+        for pattern, hits in self.collect_patterns().items():
+            automaton.add_word(pattern, (pattern, hits))
+        automaton.make_automaton()
+        return automaton
+    
+    def build_keyword_index(self):
+        """Fallback for build_automaton: token and first-token phrase lookup tables"""
+        # token -> [(intervention index, weight), ...]
+        keyword_index = {}
+        # first token -> {" token token ": [(intervention index, weight), ...]}
+        phrase_index = {}
+        for pattern, hits in self.collect_patterns().items():
+            tokens = TOKEN_RE.findall(pattern)
+            if not tokens:
+                continue
+            if len(tokens) == 1 and tokens[0] == pattern:
+                keyword_index.setdefault(pattern, []).extend(hits)
+            else:
+                phrase = " " + " ".join(tokens) + " "
+                phrase_index.setdefault(tokens[0], {}).setdefault(phrase, []).extend(hits)
+        return keyword_index, phrase_index
+    
+    def build_embeddings(self):
+        """Embed every intervention for semantic search, if sentence-transformers is available"""
+        if SentenceTransformer is None or not self.database:
+            return None, None, None
+        try:
+            embedder = SentenceTransformer(EMBEDDING_MODEL)
+        except Exception as e:
+            print(f"Could not load embedding model {EMBEDDING_MODEL}: {e}")
+            return None, None, None
+        
+        cache_key = f"{EMBEDDING_MODEL}|{self.db_mtime}|{len(self.database)}"
+        cached = self.load_embedding_cache(cache_key)
+        if cached is not None:
+            return (embedder,) + cached
+        
+        texts = [f"{iv['intervention_name']}. {iv['description']} {' '.join(iv['keywords'])}"
+                 for iv in self.database]
+        # Unit-length rows, so a dot product is the cosine similarity
+        embeddings = embedder.encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+        # Stored as int8, a quarter of the float32 matrix
+        quantized, scales = quantize_rows(embeddings.astype(np.float32))
+        self.save_embedding_cache(cache_key, quantized, scales)
+        return embedder, quantized, scales
+    
+    def load_embedding_cache(self, cache_key):
+        """(embeddings, scales) saved under cache_key, or None if missing or stale"""
+        try:
+            with np.load(EMBEDDING_CACHE) as cache:
+                if str(cache['key']) != cache_key:
+                    return None
+                return cache['embeddings'], cache['scales']
+        except (OSError, KeyError, ValueError):
+            return None
+    
+    def save_embedding_cache(self, cache_key, embeddings, scales):
+        """Write the embeddings for the next start; a failed write only costs a re-encode"""
+        tmp_path = EMBEDDING_CACHE + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, key=np.array(cache_key), embeddings=embeddings, scales=scales)
+            os.replace(tmp_path, EMBEDDING_CACHE)
+        except OSError as e:
+            print(f"Could not write embedding cache: {e}")
+    
+    def semantic_scores(self, query_lower):
+        """Cosine similarity of the query to every intervention"""
+        query = self.embedder.encode([query_lower], normalize_embeddings=True, convert_to_numpy=True)
+        query_q, query_scale = quantize_rows(query.astype(np.float32))
+        # int32 accumulation: 384 products of two int8s overflow anything narrower
+        dots = self.embeddings @ query_q[0].astype(np.int32)
+        return (dots * self.embedding_scales * query_scale[0]).tolist()
+    
+    def search_interventions(self, user_query):
+        """Improved keyword-based search"""
+        return [self.database[i] for i in self.match_indices(normalize_query(user_query))]
+    
+    @functools.lru_cache(maxsize=1024)
+    def match_indices(self, query_lower):
+        """Ranked database indices for a normalized query (cached)"""
+        # Sparse: only interventions something matched get an entry
+        scores = defaultdict(int)
+        if self.automaton is not None:
+            seen = set()
+            for _, (pattern, hits) in self.automaton.iter(query_lower):
+                # A pattern scores once per query, however often it occurs
+                if pattern in seen:
+                    continue
+                seen.add(pattern)
+                for i, weight in hits:
+                    scores[i] += weight
+        else:
+            keyword_index, phrase_index = self.keyword_index
+            tokens = TOKEN_RE.findall(query_lower)
+            joined = " " + " ".join(tokens) + " "
+            for token in set(tokens):
+                for i, weight in keyword_index.get(token, ()):
+                    scores[i] += weight
+                # Only phrases starting with a query token need the substring check
+                for phrase, hits in phrase_index.get(token, {}).items():
+                    if phrase in joined:
+                        for i, weight in hits:
+                            scores[i] += weight
+        
+        # Lets "pedestrian injury" reach interventions worded differently
+        if self.embeddings is not None:
+            for i, similarity in enumerate(self.semantic_scores(query_lower)):
+                if i in scores or similarity >= self.SEMANTIC_MIN_SIMILARITY:
+                    scores[i] += self.SEMANTIC_WEIGHT * max(similarity, 0.0)
+        
+        # Chit-chat like "hi" or "thanks" matches nothing, so there is nothing to rank
+        if not scores:
+            return ()
+        # Ties keep database order
+        ranked = sorted(sorted(scores), key=scores.__getitem__, reverse=True)
+        return tuple(ranked)
+    
+    def open_response_db(self):
+        """Open the on-disk reply cache, dropping expired replies; None if it can't be opened"""
+        try:
+            conn = sqlite3.connect(RESPONSE_DB_PATH, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, created REAL, response TEXT)")
+            conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.RESPONSE_CACHE_TTL,))
+            return conn
+        except sqlite3.Error as e:
+            print(f"Response cache disabled: {e}")
+            return None
+    
+    def response_key(self, key):
+        """On-disk cache key: the in-memory (query, context) key plus the system
+        prompt, model and database version the reply was generated with"""
+        user_query, focused_context = key
+        raw = "\0".join((user_query, focused_context, self.system_prompt, self.client.model, str(self.db_mtime)))
+        return hashlib.sha256(raw.encode('utf-8', 'surrogatepass')).hexdigest()
+    
+    def persisted_response(self, key):
+        """Reply stored on disk for this (query, context) key within RESPONSE_CACHE_TTL, or None"""
+        if self._response_db is None:
+            return None
+        try:
+            with self._response_db_lock:
+                row = self._response_db.execute(
+                    "SELECT response, created FROM responses WHERE key = ?",
+                    (self.response_key(key),)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Response cache read failed: {e}")
+            return None
+        if row is None or time.time() - row[1] > self.RESPONSE_CACHE_TTL:
+            return None
+        return row[0]
+    
+    def persist_response(self, key, response):
+        """Write a reply to the on-disk cache; a failed write only costs a future Ollama call"""
+        if self._response_db is None:
+            return
+        try:
+            with self._response_db_lock:
+                self._response_db.execute(
+                    "INSERT OR REPLACE INTO responses (key, created, response) VALUES (?, ?, ?)",
+                    (self.response_key(key), time.time(), response)
+                )
+        except sqlite3.Error as e:
+            print(f"Response cache write failed: {e}")
+    
+    def cached_response(self, key):
+        """Previously generated reply for key, from memory or disk, or None"""
+        with self._response_lock:
+            response = self._response_cache.get(key)
+            if response is not None:
+                self._response_cache.move_to_end(key)
+                return response
+        response = self.persisted_response(key)
+        if response is not None:
+            self._remember(key, response)
+        return response
+    
+    def store_response(self, key, response):
+        """Remember a reply in memory and on disk"""
+        # Failures aren't cached so the next attempt reaches Ollama again
+        if response.startswith("Error:"):
+            return
+        self._remember(key, response)
+        self.persist_response(key, response)
+    
+    def _remember(self, key, response):
+        """Add a reply to the in-memory LRU, evicting beyond RESPONSE_CACHE_SIZE"""
+        with self._response_lock:
+            self._response_cache[key] = response
+            self._response_cache.move_to_end(key)
+            if len(self._response_cache) > self.RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+    
+    def generate_once(self, user_query, focused_context):
+        """Cached reply, or one Ollama call shared by every concurrent identical request"""
+        key = (user_query.strip(), focused_context)
+        response = self.cached_response(key)
+        if response is not None:
+            return response
+        with self._response_lock:
+            # An identical request may have finished, or started, in the meantime
+            response = self._response_cache.get(key)
+            if response is not None:
+                return response
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        
+        if not owner:
+            return future.result()
+        try:
+            response = self.client.query_road_safety(
+                user_query, 
+                focused_context, 
+                self.system_prompt
+            )
+            self.store_response(key, response)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._response_lock:
+                del self._inflight[key]
+    
+    def get_response(self, user_query):
+        """Get AI response for user query"""
+        keyword_matches = self.search_interventions(user_query)
+        focused_context = self.prepare_database_context(user_query, keyword_matches)
+        response = self.generate_once(user_query, focused_context)
+        
+        return {
+            'ai_response': response,
+            'keyword_matches': keyword_matches[:3]  
+        }
+    
+    def stream_response(self, user_query):
+        """Like get_response, but 'ai_response' is a generator of text chunks"""
+        keyword_matches = self.search_interventions(user_query)
+        focused_context = self.prepare_database_context(user_query, keyword_matches)
+        key = (user_query.strip(), focused_context)
+        response = self.cached_response(key)
+        if response is not None:
+            chunks = iter([response])
+        else:
+            chunks = self._stream_and_store(key, self.client.query_road_safety_stream(
+                user_query,
+                focused_context,
+                self.system_prompt
+            ))
+        
+        return {
+            'ai_response': chunks,
+            'keyword_matches': keyword_matches[:3]
+        }
+    
+    def _stream_and_store(self, key, chunks):
+        """Pass chunks through, caching the full reply once the stream completes"""
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        if not any(part.startswith("Error:") for part in parts):
+            self.store_response(key, "".join(parts))
+
+# The one engine per process, whichever front end (web app or CLI) asks first
+@functools.lru_cache(maxsize=1)
+def get_road_safety_gpt():
+    return RoadSafetyGPT()
@@ -0,0 +1,46 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import Analytics
+
+class AnalyticsWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.analytics = Analytics(None, os.path.join(self.tmp.name, 'analytics.db'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def stored_queries(self):
+        rows = self.analytics._reader().execute('SELECT user_query FROM user_queries').fetchall()
+        return [row[0] for row in rows]
+
+    def wait_for(self, user_query, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if user_query in self.stored_queries():
+                return True
+            time.sleep(0.05)
+        return False
+
+    def test_unencodable_query_does_not_stop_writer(self):
+        """A lone surrogate (a JSON "\\ud800" escape) can't be stored; later logs still are"""
+        match = {'intervention_id': 1, 'intervention_name': 'STOP Sign',
+                 'problem_type': 'Damaged', 'category': 'Road Sign'}
+        self.analytics.log_query('bad \ud800 query', [match], 0.1)
+        self.analytics.log_query('same batch query', [match], 0.1)
+        self.assertTrue(self.wait_for('same batch query'))
+
+        # After a flush, so it lands in a fresh batch on a writer that must still be running
+        time.sleep(self.analytics.FLUSH_INTERVAL * 2)
+        self.analytics.log_query('later query', [match], 0.1)
+        self.assertTrue(self.wait_for('later query'))
+        self.assertNotIn('bad \ud800 query', self.stored_queries())
+
+if __name__ == '__main__':
+    unittest.main()